@@ -31,67 +31,135 @@ def fetch_espn_data(league_id, year, week, espn_s2=None, swid=None):
 
 
 def add_constraints():
-    solver = z3.Solver()
+    # linear integer arithmetic only; keep an incremental solver for enumeration
+    solver = z3.SolverFor("QF_LIA")
     # variables for centipoints scored this week
     points = [z3.Int(f"points_{i}") for i in range(len(player_to_index))]
-    # variables for total wins
-    wins = [z3.Int(f"wins_{i}") for i in range(len(player_to_index))]
-    # variable for final place
-    place = [z3.Int(f"place_{i}") for i in range(len(player_to_index))]
+    # whether p1 won each matchup
+    won = [z3.Bool(f"won_{k}") for k in range(len(matchups))]
+    # season total centipoints, built once and shared by every constraint
+    totals = [points[i] + current_points[i] for i in range(len(player_to_index))]
     # assumme 50 < p < 200
-    solver.add([z3.And(p >= 5000, p <= 20000) for p in points])
+    for p in points:
+        solver.add(p >= 5000, p <= 20000)
     # add a win if you beat your opponent
-    for p1, p2 in matchups:
-        solver.add(z3.If(points[p1] >= points[p2],
-                         wins[p1] == current_wins[p1] + 1,
-                         wins[p1] == current_wins[p1]))
-        solver.add(z3.If(points[p2] > points[p1],
-                         wins[p2] == current_wins[p2] + 1,
-                         wins[p2] == current_wins[p2]))
+    wins = [z3.IntVal(w) for w in current_wins]
+    for k, (p1, p2) in enumerate(matchups):
+        solver.add(won[k] == (points[p1] >= points[p2]))
+        # a matchup can't end in a tie
+        solver.add(points[p1] != points[p2])
+        wins[p1] = wins[p1] + z3.If(won[k], 1, 0)
+        wins[p2] = wins[p2] + z3.If(won[k], 0, 1)
     # disallow final point ties
-    for i in range(len(player_to_index)):
-        for j in range(i + 1, len(player_to_index)):
-            solver.add(z3.And(points[i] + current_points[i] != points[j] + current_points[j]))
-            solver.add(z3.And(points[i] != points[j]))
-    # calculate place based on wins and points
-    for i in range(len(player_to_index)):
-        better_count = []
-        for j in range(len(player_to_index)):
-            if i == j:
-                continue
-            better = z3.Or(wins[j] > wins[i],
-                           z3.And(wins[j] == wins[i],
-                                  current_points[j] + points[j] > current_points[i] + points[i]))
-            better_count.append(z3.If(better, 1, 0))
-        solver.add(place[i] == 1 + z3.Sum(better_count))
-    return solver, place, wins, points
+    solver.add(z3.Distinct(totals))
+    return solver, won, wins, points, totals
+
+_league_cache = {}
+
+def get_league_cache():
+    # results derived from the league globals, dropped whenever they change
+    league = (tuple(player_to_index.items()), tuple(current_wins),
+              tuple(current_points), tuple(matchups))
+    if _league_cache.get("league") != league:
+        _league_cache.clear()
+        _league_cache["league"] = league
+    return _league_cache
+
+def get_base_constraints():
+    # the league constraints are the same for every query, so build them once;
+    # callers push/pop around whatever they add
+    cache = get_league_cache()
+    if "base_constraints" not in cache:
+        cache["base_constraints"] = add_constraints()
+    return cache["base_constraints"]
+
+def get_index_to_player():
+    cache = get_league_cache()
+    if "index_to_player" not in cache:
+        cache["index_to_player"] = {v: k for k, v in player_to_index.items()}
+    return cache["index_to_player"]
+
+def finishes_ahead(wins, totals, j, i):
+    # player j finishes ahead of player i on wins, then total points
+    return z3.Or(wins[j] > wins[i],
+                 z3.And(wins[j] == wins[i],
+                        totals[j] > totals[i]))
+
+def players_ahead(wins, totals, i):
+    # pseudo-boolean terms counting the players who finish ahead of player i
+    return [(finishes_ahead(wins, totals, j, i), 1)
+            for j in range(len(player_to_index)) if j != i]
+
+def get_places(scenario):
+    # place is a pure function of wins and total points, so rank in Python
+    # rather than asking the solver to do it
+    order = sorted(scenario, key=lambda i: (-scenario[i]["wins"],
+                                            -(current_points[i] + scenario[i]["points"] * 100)))
+    return {i: place for place, i in enumerate(order, start=1)}
+
+def get_outcome_wins(outcomes):
+    # final wins for a complete set of matchup results
+    outcome_wins = list(current_wins)
+    for (p1, p2), outcome in zip(matchups, outcomes):
+        outcome_wins[p1 if outcome == 0 else p2] += 1
+    return outcome_wins
+
+def get_place_constraints(outcome_wins, totals, targets):
+    # with wins known, only players tied on wins can still finish ahead of a
+    # target, so bound how many of those beat it on total points; None if
+    # too many players are already ahead on wins alone
+    place_constraints = []
+    for i, final_place in targets:
+        ahead_on_wins = sum(w > outcome_wins[i] for w in outcome_wins)
+        if ahead_on_wins >= final_place:
+            return None
+        tied = [(totals[j] > totals[i], 1) for j, w in enumerate(outcome_wins)
+                if j != i and w == outcome_wins[i]]
+        if tied:
+            place_constraints.append(z3.PbLe(tied, final_place - 1 - ahead_on_wins))
+    return place_constraints
 
 def get_scenarios(player_place_list):
-    solver, place, wins, points = add_constraints()
-    for player, final_place in player_place_list:
-        player_index = player_to_index[player]
-        solver.add(place[player_index] <= final_place)
+    solver, won, wins, points, totals = get_base_constraints()
+    targets = [(player_to_index[player], final_place)
+               for player, final_place in player_place_list]
     scenarios = []
-    while solver.check() == z3.sat:
-        model = solver.model()
-        scenario = {}
-        for i in range(len(player_to_index)):
-            scenario[i] = {
-                "points": model[z3.Int(f"points_{i}")].as_long() / 100.0,
-                "wins": model[z3.Int(f"wins_{i}")].as_long(),
-                "place": model[z3.Int(f"place_{i}")].as_long(),
-            }
-        scenarios.append(scenario)
-        # add constraint to avoid getting the same scenario again
-        scenario_constraint = []
-        for i in range(len(player_to_index)):
-            scenario_constraint.append(
-                z3.Int(f"place_{i}") != model[z3.Int(f"place_{i}")]
-            )
-            scenario_constraint.append(
-                z3.Int(f"wins_{i}") != model[z3.Int(f"wins_{i}")] )
-
-        solver.add(z3.Or(scenario_constraint))
+    # wins are fixed by the matchup results, so walk the 2^M result sets in
+    # Python and leave only the order on total points to the solver
+    for outcomes in itertools.product([0, 1], repeat=len(matchups)):
+        outcome_wins = get_outcome_wins(outcomes)
+        place_constraints = get_place_constraints(outcome_wins, totals, targets)
+        if place_constraints is None:
+            continue
+        solver.push()
+        solver.add([won[k] if outcome == 0 else z3.Not(won[k])
+                    for k, outcome in enumerate(outcomes)])
+        solver.add(place_constraints)
+        while solver.check() == z3.sat:
+            model = solver.model()
+            scenario = {}
+            for i in range(len(player_to_index)):
+                scenario[i] = {
+                    "points": model[points[i]].as_long() / 100.0,
+                    "wins": outcome_wins[i],
+                }
+            places = get_places(scenario)
+            for i in range(len(player_to_index)):
+                scenario[i]["place"] = places[i]
+            scenarios.append(scenario)
+            # add constraint to avoid getting the same scenario again. with
+            # the results fixed, places only depend on the order of total
+            # points within each group tied on wins, so swap two adjacent
+            # tied players
+            scenario_constraint = []
+            order = sorted(places, key=places.get)
+            for j, i in zip(order, order[1:]):
+                if outcome_wins[j] == outcome_wins[i]:
+                    scenario_constraint.append(totals[i] > totals[j])
+            if not scenario_constraint:
+                break
+            solver.add(z3.Or(scenario_constraint))
+        solver.pop()
     return scenarios
 
 def get_matchup_outcomes(scenario, matchups, player_to_index):
@@ -105,42 +173,82 @@ def get_matchup_outcomes(scenario, matchups, player_to_index):
             outcomes[i] = 1
     return outcomes
 
+def outcome_mask(outcomes):
+    # encode outcomes as bitmasks of decided matchups and of matchups won by p2
+    mask = val = 0
+    for i, outcome in enumerate(outcomes):
+        if outcome is not None:
+            mask |= 1 << i
+            if outcome == 1:
+                val |= 1 << i
+    return mask, val
+
 def subsumes(existing, candidate):
-    non_none_indices_existing = [i for i, v in enumerate(existing) if v is not None]
-    if all(existing[i] == candidate[i] for i in non_none_indices_existing):
-        return True
-    return False
+    # both are (mask, val) pairs from outcome_mask; existing subsumes candidate
+    # if candidate decides every matchup existing does, the same way
+    existing_mask, existing_val = existing
+    candidate_mask, candidate_val = candidate
+    return (existing_mask & candidate_mask == existing_mask
+            and (existing_val ^ candidate_val) & existing_mask == 0)
 
-def search_for_sufficient_conditions(player_place_list, matchups):
-    solver, place, wins, points = add_constraints()
+def outcomes_by_specificity(num_matchups):
+    # every partial assignment of matchup results, fewest decided results first
+    for k in range(num_matchups + 1):
+        for positions in itertools.combinations(range(num_matchups), k):
+            for values in itertools.product([0, 1], repeat=k):
+                outcomes = [None] * num_matchups
+                for i, v in zip(positions, values):
+                    outcomes[i] = v
+                yield tuple(outcomes)
+
+def get_guaranteed_outcomes(player_place_list, matchups):
+    # complete sets of matchup results under which the goal cannot be missed
+    solver, won, wins, points, totals = get_base_constraints()
+    solver.push()
     for player, final_place in player_place_list:
         player_index = player_to_index[player]
-        solver.add(place[player_index] > final_place)
-    outcome_sets = itertools.product([None, 0, 1], repeat=len(matchups))
+        solver.add(z3.PbGe(players_ahead(wins, totals, player_index), final_place))
+    all_outcomes = list(itertools.product([0, 1], repeat=len(matchups)))
+    if solver.check() == z3.unsat:
+        # already guaranteed whatever happens
+        guaranteed = set(all_outcomes)
+    else:
+        guaranteed = set()
+        for outcomes in all_outcomes:
+            # check under the results as assumptions rather than push/pop
+            outcome_literals = [won[k] if outcome == 0 else z3.Not(won[k])
+                                for k, outcome in enumerate(outcomes)]
+            if solver.check(*outcome_literals) == z3.unsat:
+                guaranteed.add(outcomes)
+    solver.pop()
+    return guaranteed
+
+def search_for_sufficient_conditions(player_place_list, matchups):
+    # every matchup has exactly one result, so a set of results is sufficient
+    # iff each way of filling in the undecided matchups is; only the complete
+    # result vectors need to go to the solver
+    guaranteed = get_guaranteed_outcomes(player_place_list, matchups)
     sufficient_conditions = []
-    for outcomes in outcome_sets:
-        if any(subsumes(existing, outcomes) for existing in sufficient_conditions):
+    sufficient_masks = []
+    if not guaranteed:
+        return sufficient_conditions
+    # conditions are visited coarsest first, so anything refining a condition
+    # already found is skipped without checking its completions
+    for outcomes in outcomes_by_specificity(len(matchups)):
+        mask = outcome_mask(outcomes)
+        if any(subsumes(existing, mask) for existing in sufficient_masks):
             continue
-        outcome_constraints = []
-        for i, (p1, p2) in enumerate(matchups):
-            if outcomes[i] == 0:
-                outcome_constraints.append(
-                    points[p1] >= points[p2]
-                )
-            elif outcomes[i] == 1:
-                outcome_constraints.append(
-                   points[p2] > points[p1]
-                )
-        solver.push()
-        solver.add(outcome_constraints)
-        if solver.check() == z3.unsat:
+        completions = itertools.product(*[[0, 1] if o is None else [o] for o in outcomes])
+        if all(completion in guaranteed for completion in completions):
             sufficient_conditions.append(outcomes)
-        solver.pop()
+            sufficient_masks.append(mask)
+            if all(o is None for o in outcomes):
+                break
     return sufficient_conditions
 
 def get_final_standings_table(scenario, player_to_index):
     standings = []
-    index_to_player = {v: k for k, v in player_to_index.items()}
+    index_to_player = get_index_to_player()
     for i in range(len(player_to_index)):
         player_name = index_to_player[i]
         total_points = current_points[i] + scenario[i]["points"]*100
@@ -151,17 +259,40 @@ def get_final_standings_table(scenario, player_to_index):
     return standings
 
 def get_necessary_outcomes(scenarios):
-    necessary_outcomes = []
-    for i in range(len(matchups)):
-        outcome_set = set()
-        for scenario in scenarios:
-            outcomes = get_matchup_outcomes(scenario, matchups, player_to_index)
-            outcome_set.add(outcomes[i])
-        if len(outcome_set) == 1:
-            necessary_outcomes.append(outcome_set.pop())
+    outcome_sets = [set() for _ in matchups]
+    for scenario in scenarios:
+        for outcome_set, (p1, p2) in zip(outcome_sets, matchups):
+            outcome_set.add(0 if scenario[p1]["points"] >= scenario[p2]["points"] else 1)
+        # stop once every matchup has been seen going both ways
+        if all(len(outcome_set) == 2 for outcome_set in outcome_sets):
+            break
+    return [outcome_set.pop() if len(outcome_set) == 1 else None
+            for outcome_set in outcome_sets]
+
+def get_player_scenarios(player, final_place):
+    # scenarios for a tighter goal are a subset of those for a looser one, so
+    # filter an already-computed looser run instead of solving again
+    cache = get_league_cache()
+    key = ("scenarios", player, final_place)
+    if key not in cache:
+        looser = [k[2] for k in cache
+                  if k[:2] == ("scenarios", player) and k[2] > final_place]
+        if looser:
+            player_index = player_to_index[player]
+            cache[key] = [
+                scenario for scenario in cache[("scenarios", player, min(looser))]
+                if scenario[player_index]["place"] <= final_place
+            ]
         else:
-            necessary_outcomes.append(None)
-    return necessary_outcomes
+            cache[key] = get_scenarios([(player, final_place)])
+    return cache[key]
+
+def get_player_sufficient_conditions(player, final_place):
+    cache = get_league_cache()
+    key = ("sufficient_conditions", player, final_place)
+    if key not in cache:
+        cache[key] = search_for_sufficient_conditions([(player, final_place)], matchups)
+    return cache[key]
 
 def analyze(player_name, threshold='playoffs'):
     if threshold == 'playoffs':
@@ -173,14 +304,14 @@ def analyze(player_name, threshold='playoffs'):
         goal = "get a first round bye"
         goal_ing = "getting a first round bye"
     print(f"Analyzing scenarios for {player_name} to {goal}...")
-    scenarios = get_scenarios([(player_name, final_place)])
+    scenarios = get_player_scenarios(player_name, final_place)
     print(len(scenarios), "scenarios found.")
     if len(scenarios) == 0:
         print(f"Bummer, {player_name} cannot {goal} under any circumstances.")
         return
     necessary_outcomes = get_necessary_outcomes(scenarios)
-    sufficient_conditions = search_for_sufficient_conditions([(player_name, final_place)], matchups)
-    index_to_player = {v: k for k, v in player_to_index.items()}
+    sufficient_conditions = get_player_sufficient_conditions(player_name, final_place)
+    index_to_player = get_index_to_player()
     print(f"If these outcomes occur, then {player_name} is guaranteed to {goal}...")
     if not sufficient_conditions:
         print("  None found.")
@@ -196,8 +327,7 @@ def analyze(player_name, threshold='playoffs'):
                 outcome_str = (f"   {index_to_player[p2]} wins vs {index_to_player[p1]}")
                 strings.append(outcome_str)
         if all(outcome is None for outcome in cond):
-            strings.append("This is already guaranteed!")
-            return
+            strings.append("   This is already guaranteed!")
         full_str = " AND \n".join(strings)
         print(full_str)
     print(f"{player_name} needs these results to have a shot at {goal_ing}...")